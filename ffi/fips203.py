@@ -21,6 +21,15 @@ Encapsulation keys, decapsulation keys, and ciphertexts can all be
 serialized by accessing them as `bytes`, and deserialized by
 initializing them with the appropriate size bytes object.
 
+Many key pairs can be generated at once, in parallel across threads,
+with `keygen_batch()`:
+
+```
+from fips203 import ML_KEM_768
+
+keypairs = ML_KEM_768.keygen_batch(100)
+```
+
 A serialization example:
 
 ```
@@ -58,9 +67,23 @@ print(f"ML-KEM-768 Ciphertext size (in bytes) is {ML_KEM_768.CT_SIZE}")
 ## Implementation Notes
 
 This is a wrapper around libfips203, built from the Rust fips203-ffi crate.
+It binds the library with the standard `ctypes` module, so it needs no
+compiled extension or other Python packages.
+
+The library is loaded the first time a key or ciphertext is created.
+Set the `FIPS203_LIB` environment variable to the path of the shared
+object to pick a specific build; otherwise it is looked up in the
+expected path for libraries on your system.  If it cannot be found,
+that first use raises `OSError`.
+
+Loading the library and binding its functions therefore adds latency
+to the first operation in a process.  Callers that care about that can
+call `fips203.preload()` at startup, which does the work for every
+parameter set up front (and raises `OSError` early if the library is
+missing).
 
-If that library is not installed in the expected path for libraries on
-your system, any attempt to use this module will fail.
+Calls into the library release the GIL, so keygen, encapsulation, and
+decapsulation can run concurrently from multiple Python threads.
 
 ## See Also
 
@@ -78,12 +101,15 @@ __all__ = [
     'Ciphertext',
     'EncapsulationKey',
     'DecapsulationKey',
+    'preload',
 ]
 
+import concurrent.futures
 import ctypes
 import ctypes.util
 import enum
-from typing import Tuple, Dict, Any, Union
+import os
+from typing import Tuple, Dict, Any, List, Optional, Type, Union
 from abc import ABC
 
 
@@ -110,6 +136,8 @@ class Ciphertext():
     Decaps() function of the appropriate Decapsulation Key.
 
     '''
+    __slots__ = ('_strength', '_buf', '_ct', '_ct_ptr', '__weakref__')
+
     def __init__(self, data: Union[bytes, int]) -> None:
         '''Create ML-KEM Ciphertext from bytes (or strength level).'''
         if isinstance(data, bytes):
@@ -119,24 +147,19 @@ class Ciphertext():
         else:
             raise Exception("Initialize ML-KEM Ciphertext object with "
                             f"bytes or a strength level, not {type(data)}")
-        self._ffi = _ML_KEM.strength(self._strength)
-        self._ct = self._ffi['Ciphertext']()
-
+        kem = _ML_KEM.strength(self._strength)
         if isinstance(data, bytes):
-            self._set(data)
+            self._buf = bytearray(data)
+        else:
+            self._buf = bytearray(kem.CT_SIZE)
+        self._ct = kem._Ciphertext.from_buffer(self._buf)
+        self._ct_ptr = ctypes.pointer(self._ct)
 
     def __repr__(self) -> str:
         return f'<ML-KEM-{self._strength} Ciphertext>'
 
     def __bytes__(self) -> bytes:
-        return bytes(self._ct.data)
-
-    def _set(self, data: bytes) -> None:
-        if len(data) != len(self._ct.data):
-            raise ValueError(f"Expected {len(self._ct.data)} bytes, "
-                             f"got {len(data)}")
-        for i in range(len(data)):
-            self._ct.data[i] = data[i]
+        return bytes(self._buf)
 
 
 class EncapsulationKey():
@@ -147,6 +170,9 @@ class EncapsulationKey():
     Produce a Ciphertext and a 32-byte shared secret by invoking
     Encaps() on it.
     '''
+    __slots__ = ('_strength', '_buf', '_ek', '_ek_ptr', '_encaps_fn',
+                 '__weakref__')
+
     def __init__(self, data: Union[bytes, int]) -> None:
         '''Create ML-KEM Encapsulation Key from bytes (or strength level).'''
         if isinstance(data, bytes):
@@ -156,35 +182,41 @@ class EncapsulationKey():
         else:
             raise Exception("Initialize ML-KEM Encapsulation Key with "
                             f"bytes or a strength level, not {type(data)}")
-        self._ffi = _ML_KEM.strength(self._strength)
-        self._ek = self._ffi['EncapsKey']()
+        kem = _ML_KEM.strength(self._strength)
         if isinstance(data, bytes):
-            self._set(data)
+            self._buf = bytearray(data)
+        else:
+            self._buf = bytearray(kem.EK_SIZE)
+        self._ek = kem._EncapsKey.from_buffer(self._buf)
+        self._ek_ptr = ctypes.pointer(self._ek)
+        self._encaps_fn = kem._encaps_fn
 
     def __repr__(self) -> str:
         return f'<ML-KEM-{self._strength} Encapsulation Key>'
 
     def __bytes__(self) -> bytes:
-        return bytes(self._ek.data)
-
-    def _set(self, data: bytes) -> None:
-        if len(data) != len(self._ek.data):
-            raise ValueError(f"Expected {len(self._ek.data)} bytes, "
-                             f"got {len(data)}")
-        for i in range(len(data)):
-            self._ek.data[i] = data[i]
+        return bytes(self._buf)
 
     def encaps(self) -> Tuple[Ciphertext, bytes]:
         '''Produce a new Ciphertext and corresponding 32-byte shared secret.'''
         ct = Ciphertext(self._strength)
+        return (ct, self.encaps_into(ct))
+
+    def encaps_into(self, ct: Ciphertext) -> bytes:
+        '''Encapsulate into an existing Ciphertext, overwriting it.
+
+        Returns the corresponding 32-byte shared secret.  This lets
+        callers reuse Ciphertext objects instead of allocating a new
+        one for every encapsulation.
+        '''
+        if self._strength != ct._strength:
+            raise Exception(f"Cannot encapsulate into {ct} with {self}")
         ss = _SharedSecret()
-        ret = Err(self._ffi['encaps'](ctypes.byref(self._ek),
-                                      ctypes.byref(ct._ct),
-                                      ctypes.byref(ss)))
-        if ret is not Err.OK:
+        ret = self._encaps_fn(self._ek_ptr, ct._ct_ptr, ctypes.byref(ss))
+        if ret:
             raise Exception(f"ml_kem_{self._strength}_encaps() "
-                            f"returned {ret} ({ret.name})")
-        return (ct, bytes(ss.data))
+                            f"returned {ret} ({Err(ret).name})")
+        return bytes(ss.data)
 
 
 class DecapsulationKey():
@@ -195,6 +227,9 @@ class DecapsulationKey():
     Produce a 32-byte shared secret from a Ciphertext by invoking
     Decaps() on it.
     '''
+    __slots__ = ('_strength', '_buf', '_dk', '_dk_ptr', '_decaps_fn',
+                 '__weakref__')
+
     def __init__(self, data: Union[bytes, int]) -> None:
         '''Create ML-KEM Decapsulation Key from bytes (or strength level).'''
         if isinstance(data, bytes):
@@ -204,35 +239,30 @@ class DecapsulationKey():
         else:
             raise Exception("Initialize ML-KEM Encapsulation Key with bytes "
                             f"or a strength level, not {type(data)}")
-        self._ffi = _ML_KEM.strength(self._strength)
-        self._dk = self._ffi['DecapsKey']()
+        kem = _ML_KEM.strength(self._strength)
         if isinstance(data, bytes):
-            self._set(data)
+            self._buf = bytearray(data)
+        else:
+            self._buf = bytearray(kem.DK_SIZE)
+        self._dk = kem._DecapsKey.from_buffer(self._buf)
+        self._dk_ptr = ctypes.pointer(self._dk)
+        self._decaps_fn = kem._decaps_fn
 
     def __repr__(self) -> str:
         return f'<ML-KEM-{self._strength} Decapsulation Key>'
 
     def __bytes__(self) -> bytes:
-        return bytes(self._dk.data)
-
-    def _set(self, data: bytes) -> None:
-        if len(data) != len(self._dk.data):
-            raise ValueError(f"Expected {len(self._dk.data)} bytes, "
-                             f"got {len(data)}")
-        for i in range(len(data)):
-            self._dk.data[i] = data[i]
+        return bytes(self._buf)
 
     def decaps(self, ct: Ciphertext) -> bytes:
         '''Get 32-byte shared secret corresponding to the given Ciphertext.'''
         if self._strength != ct._strength:
             raise Exception(f"Cannot decapsulate {ct} with {self}")
         ss = _SharedSecret()
-        ret = Err(self._ffi['decaps'](ctypes.byref(self._dk),
-                                      ctypes.byref(ct._ct),
-                                      ctypes.byref(ss)))
-        if ret is not Err.OK:
+        ret = self._decaps_fn(self._dk_ptr, ct._ct_ptr, ctypes.byref(ss))
+        if ret:
             raise Exception(f"ml_kem_{self._strength}_decaps() "
-                            f"returned {ret} ({ret.name})")
+                            f"returned {ret} ({Err(ret).name})")
         return bytes(ss.data)
 
 
@@ -254,60 +284,102 @@ class _ML_KEM():
             'CT_SIZE': 1568,
             },
         }
-    lib = ctypes.CDLL(ctypes.util.find_library('fips203'))
-    if not hasattr(lib, 'ml_kem_512_keygen'): lib = ctypes.CDLL("../target/debug/libfips203.so")
+    # (object_type, object_len) -> strength, for strength_from_length()
+    _by_length: Dict[Tuple[str, int], int] = {
+        (object_type, object_len): strength
+        for strength, sizes in params.items()
+        for object_type, object_len in sizes.items()
+    }
+    # parameter set classes, populated at import time below
+    kem: Dict[int, Type['ML_KEM']] = {}
+    _lib: Optional[ctypes.CDLL] = None
+
+    @classmethod
+    def _load_lib(cls) -> ctypes.CDLL:
+        '''Find and load libfips203, once.
+
+        Use $FIPS203_LIB if it is set, otherwise look in the system
+        library path and then in ../target/{release,debug}.
+        '''
+        if cls._lib is not None:
+            return cls._lib
+        path = os.environ.get('FIPS203_LIB')
+        if path:
+            try:
+                lib = ctypes.CDLL(path)
+            except OSError as e:
+                raise OSError(f"Cannot load FIPS203_LIB={path}: {e}") from e
+            if not hasattr(lib, 'ml_kem_512_keygen'):
+                raise OSError(f"FIPS203_LIB={path} is not libfips203 "
+                              "(no ml_kem_512_keygen symbol)")
+        else:
+            for path in (ctypes.util.find_library('fips203'),
+                         '../target/release/libfips203.so',
+                         '../target/debug/libfips203.so'):
+                if path is None:
+                    continue
+                try:
+                    lib = ctypes.CDLL(path)
+                except OSError:
+                    continue
+                if hasattr(lib, 'ml_kem_512_keygen'):
+                    break
+            else:
+                raise OSError("Cannot find libfips203 (set FIPS203_LIB "
+                              "to the path of the shared library)")
+        cls._lib = lib
+        return lib
 
-    # use Any below because i don't know how to specify the type of the FuncPtr
-    ffi: Dict[int, Dict[str, Any]] = {}
+    @classmethod
+    def register(cls, kem: Type['ML_KEM']) -> None:
+        level = kem._strength
+
+        # The C structs (ml_kem_*_encaps_key etc.) only wrap a uint8_t
+        # array, so a bare array of the same size has the same layout.
+        # They are c_uint8 arrays, not c_char: a c_char array reads back
+        # through .value only up to the first NUL (truncating binary data)
+        # and accepts shorter values on assignment without complaint.
+        kem._EncapsKey = ctypes.c_uint8 * cls.params[level]['EK_SIZE']
+        kem._DecapsKey = ctypes.c_uint8 * cls.params[level]['DK_SIZE']
+        kem._Ciphertext = ctypes.c_uint8 * cls.params[level]['CT_SIZE']
+        cls.kem[level] = kem
 
     @classmethod
-    def strength(cls, level: int) -> Dict[str, Any]:
-        if level not in cls.ffi:
-            class _EncapsKey(ctypes.Structure):
-                _fields_ = [('data', ctypes.c_uint8 *
-                             cls.params[level]['EK_SIZE'])]
-
-            class _DecapsKey(ctypes.Structure):
-                _fields_ = [('data', ctypes.c_uint8 *
-                             cls.params[level]['DK_SIZE'])]
-
-            class _Ciphertext(ctypes.Structure):
-                _fields_ = [('data', ctypes.c_uint8 *
-                             cls.params[level]['CT_SIZE'])]
-            ffi: Dict[str, Any] = {}
-
-            ffi['keygen'] = cls.lib[f'ml_kem_{level}_keygen']
-            ffi['keygen'].argtypes = [ctypes.POINTER(_EncapsKey),
-                                      ctypes.POINTER(_DecapsKey)]
-            ffi['keygen'].restype = ctypes.c_uint8
-
-            ffi['encaps'] = cls.lib[f'ml_kem_{level}_encaps']
-            ffi['encaps'].argtypes = [ctypes.POINTER(_EncapsKey),
-                                      ctypes.POINTER(_Ciphertext),
-                                      ctypes.POINTER(_SharedSecret)]
-            ffi['encaps'].restype = ctypes.c_uint8
-
-            ffi['decaps'] = cls.lib[f'ml_kem_{level}_decaps']
-            ffi['decaps'].argtypes = [ctypes.POINTER(_DecapsKey),
-                                      ctypes.POINTER(_Ciphertext),
-                                      ctypes.POINTER(_SharedSecret)]
-            ffi['decaps'].restype = ctypes.c_uint8
-
-            ffi['EncapsKey'] = _EncapsKey
-            ffi['DecapsKey'] = _DecapsKey
-            ffi['Ciphertext'] = _Ciphertext
-
-            cls.ffi[level] = ffi
-
-        return cls.ffi[level]
+    def strength(cls, level: int) -> Type['ML_KEM']:
+        kem = cls.kem[level]
+        if kem._keygen_fn is None:
+            lib = cls._load_lib()
+
+            # CFUNCTYPE prototypes release the GIL for the duration of
+            # each call, so other Python threads keep running while the
+            # library does its work.
+            encaps = ctypes.CFUNCTYPE(ctypes.c_uint8,
+                                      ctypes.POINTER(kem._EncapsKey),
+                                      ctypes.POINTER(kem._Ciphertext),
+                                      ctypes.POINTER(_SharedSecret))
+            kem._encaps_fn = encaps((f'ml_kem_{level}_encaps', lib))
+
+            decaps = ctypes.CFUNCTYPE(ctypes.c_uint8,
+                                      ctypes.POINTER(kem._DecapsKey),
+                                      ctypes.POINTER(kem._Ciphertext),
+                                      ctypes.POINTER(_SharedSecret))
+            kem._decaps_fn = decaps((f'ml_kem_{level}_decaps', lib))
+
+            # bound last, so a non-None _keygen_fn means all are ready
+            keygen = ctypes.CFUNCTYPE(ctypes.c_uint8,
+                                      ctypes.POINTER(kem._EncapsKey),
+                                      ctypes.POINTER(kem._DecapsKey))
+            kem._keygen_fn = keygen((f'ml_kem_{level}_keygen', lib))
+
+        return kem
 
     @classmethod
     def strength_from_length(cls, object_type: str, object_len: int) -> int:
-        for strength in cls.params:
-            if cls.params[strength][object_type] == object_len:
-                return strength
-        raise Exception(f"No ML-KEM parameter set has {object_type} "
-                        f"of {object_len} bytes")
+        try:
+            return cls._by_length[(object_type, object_len)]
+        except KeyError:
+            raise Exception(f"No ML-KEM parameter set has {object_type} "
+                            f"of {object_len} bytes") from None
 
     @classmethod
     def _keygen(cls, strength: int) -> Tuple[EncapsulationKey,
@@ -315,13 +387,21 @@ class _ML_KEM():
         ek = EncapsulationKey(strength)
         dk = DecapsulationKey(strength)
 
-        ret = Err(cls.strength(strength)['keygen'](ctypes.byref(ek._ek),
-                                                   ctypes.byref(dk._dk)))
-        if ret is not Err.OK:
+        ret = cls.kem[strength]._keygen_fn(ek._ek_ptr, dk._dk_ptr)
+        if ret:
             raise Exception(f"ml_kem_{strength}_keygen() returned "
-                            f"{ret} ({ret.name})")
+                            f"{ret} ({Err(ret).name})")
         return (ek, dk)
 
+    @classmethod
+    def _keygen_batch(cls, strength: int, n: int,
+                      max_workers: Optional[int] = None
+                      ) -> List[Tuple[EncapsulationKey, DecapsulationKey]]:
+        if max_workers is None:
+            max_workers = max(1, min(n, os.cpu_count() or 1))
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+            return list(pool.map(cls._keygen, [strength] * n))
+
 
 class ML_KEM(ABC):
     '''Abstract base class for all ML-KEM (FIPS 203) parameter sets.'''
@@ -332,11 +412,30 @@ class ML_KEM(ABC):
     CT_SIZE: int
     SS_SIZE: int = 32
 
+    # FFI functions and ctypes array types for this parameter set
+    _keygen_fn: Any = None
+    _encaps_fn: Any = None
+    _decaps_fn: Any = None
+    _EncapsKey: Any
+    _DecapsKey: Any
+    _Ciphertext: Any
+
     @classmethod
     def keygen(cls) -> Tuple[EncapsulationKey, DecapsulationKey]:
         '''Generate a pair of Encapsulation and Decapsulation Keys.'''
         return _ML_KEM._keygen(cls._strength)
 
+    @classmethod
+    def keygen_batch(cls, n: int, max_workers: Optional[int] = None
+                     ) -> List[Tuple[EncapsulationKey, DecapsulationKey]]:
+        '''Generate n pairs of Encapsulation and Decapsulation Keys.
+
+        The keys are generated in parallel on a pool of up to
+        max_workers threads (by default, one per CPU, and no more than
+        n).
+        '''
+        return _ML_KEM._keygen_batch(cls._strength, n, max_workers)
+
 
 class ML_KEM_512(ML_KEM):
     '''ML-KEM-512 (FIPS 203) Implementation.'''
@@ -360,3 +459,22 @@ class ML_KEM_1024(ML_KEM):
     EK_SIZE: int = 1568
     DK_SIZE: int = 3168
     CT_SIZE: int = 1568
+
+
+# Create the ctypes array types for every parameter set at import time.
+# The library itself is loaded, and its functions bound, the first time
+# each parameter set is used, or up front by preload().
+for _kem in (ML_KEM_512, ML_KEM_768, ML_KEM_1024):
+    _ML_KEM.register(_kem)
+del _kem
+
+
+def preload() -> None:
+    '''Load libfips203 and bind the functions for every parameter set.
+
+    This moves the one-time setup cost out of the first keygen,
+    encapsulation, or decapsulation.  Raises OSError if the library
+    cannot be found.
+    '''
+    for level in _ML_KEM.kem:
+        _ML_KEM.strength(level)